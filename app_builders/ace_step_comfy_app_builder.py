@@ -3,7 +3,8 @@ Class for building ComfyUI apps to run ACE-Step in the browser
 """
 
 
-import subprocess
+from functools import partial
+import os
 
 from app_builders.comfy_app_builder import ComfyAppBuilder
 import comfy_utils
@@ -18,15 +19,10 @@ class ACEStepComfyAppBuilder(ComfyAppBuilder):
     app_builder = ACEStepComfyAppBuilder()
     app = app_builder.build_app()
     app_builder.print_output_volume_usage()
-    @app.function(
-        max_containers=1,  # limit interactive session to 1 container
-        gpu=app_builder.gpu,
-        volumes=app_builder.get_volumes(),
-    )
-    @modal.concurrent(max_inputs=10)  # required for UI startup process which runs several API calls concurrently
-    @modal.web_server(8000, startup_timeout=60)
+    @app_builder.register_ui(app)
     def ui():
         subprocess.Popen("comfy launch -- --listen 0.0.0.0 --port 8000", shell=True)
+        app_builder.prefetch_models()
     ```
     """
     def __init__(self):
@@ -56,12 +52,8 @@ class ACEStepComfyAppBuilder(ComfyAppBuilder):
         """
         image = super()._build_image()
         # Dependencies for comfy node audiotools
-        image = image.apt_install("sox")
-        image = image.apt_install("ffmpeg")
-        image = image.apt_install("libportaudio2")
-        image = image.pip_install("sounddevice")
-        image = image.pip_install("easydict")
-        image = image.pip_install("torch-complex")
+        image = image.apt_install("sox", "ffmpeg", "libportaudio2")
+        image = image.pip_install("sounddevice", "easydict", "torch-complex")
         return image
 
     def _post_install_dep(self, image):
@@ -106,61 +98,65 @@ class ACEStepComfyAppBuilder(ComfyAppBuilder):
             image (modal.Image): The image with the comfy nodes installed
         """
         image = super()._install_comfy_nodes(image)
-        image = image.run_commands(
-            "comfy node install --fast-deps ace-step",
-            "comfy node install --fast-deps audiotools",
-            "comfy node install --fast-deps ComfyUI-Qwen3",
-        )
+        # Install the nodes in one comfy-cli call so their dependencies are resolved and installed together
+        image = image.run_commands("comfy node install --fast-deps ace-step audiotools ComfyUI-Qwen3")
         return image
 
-    def _hf_download(self, tokens={}):
+    def _hf_download(self, tokens={}, redownload_models=False):
         """
         Download models from HuggingFace
 
         Args:
             tokens (dict{string: string}): Tokens for downloading models from HuggingFace and Civitai
+            redownload_models (bool): Set to True to download the models even if they are already in the cache
         """
-        super()._hf_download(tokens=tokens)
-        self._ace_step_download()
-        self._qwen_download()
+        super()._hf_download(tokens=tokens, redownload_models=redownload_models)
+        comfy_utils.run_concurrently([
+            partial(self._ace_step_download, redownload_models),
+            partial(self._qwen_download, redownload_models),
+        ])
 
-    def _ace_step_download(self):
+    def _ace_step_download(self, force_download):
         """
         Downloads ACE-Step into the cache and creates a symbolic link to it in the correct directory for ComfyUI to use
+
+        Args:
+            force_download (bool): Set to True to download the models even if they are already in the cache
         """
     
         save_dir = f"{self._comfy_models_dir}/TTS"
-        subprocess.run(
-            f"mkdir -p {save_dir}",
-            shell=True,
-            check=True,
-        )
+        os.makedirs(save_dir, exist_ok=True)
         comfy_utils.download_hf_snapshot("ACE-Step/ACE-Step-v1-3.5B",
                                          "ACE-Step-v1-3.5B",
                                          self._cache_dir,
                                          save_dir,
-                                         allow_patterns=["*.json", "*.safetensors"])
+                                         allow_patterns=["*.json", "*.safetensors"],
+                                         force_download=force_download)
 
-    def _qwen_download(self):
+    def _qwen_download(self, force_download):
         """
         Downloads Qwen3 into the cache and creates a symbolic link to it in the correct directory for ComfyUI to use
+
+        Args:
+            force_download (bool): Set to True to download the models even if they are already in the cache
         """
     
-        save_dir = f"{self._comfy_models_dir}/Qwen/Qwen/Qwen3-14B"
-    
-        subprocess.run(
-            f"mkdir -p {save_dir}",
-            shell=True,
-            check=True,
-        )
-    
-        repo = "Qwen/Qwen3-14B"
-        for i in range(8):
-            comfy_utils.download_hf_file(repo, "model-000"+str(i+1).zfill(2)+"-of-00008.safetensors", self._cache_dir, save_dir)
-        comfy_utils.download_hf_file(repo, "config.json", self._cache_dir, save_dir)
-        comfy_utils.download_hf_file(repo, "tokenizer.json", self._cache_dir, save_dir)
-        comfy_utils.download_hf_file(repo, "vocab.json", self._cache_dir, save_dir)
-        comfy_utils.download_hf_file(repo, "merges.txt", self._cache_dir, save_dir)
-        comfy_utils.download_hf_file(repo, "generation_config.json", self._cache_dir, save_dir)
-        comfy_utils.download_hf_file(repo, "tokenizer_config.json", self._cache_dir, save_dir)
-        comfy_utils.download_hf_file(repo, "model.safetensors.index.json", self._cache_dir, save_dir)
\ No newline at end of file
+        save_dir = f"{self._comfy_models_dir}/Qwen/Qwen"
+        os.makedirs(save_dir, exist_ok=True)
+        # List the files by name rather than with glob patterns so a cached snapshot can be checked to be complete
+        filenames = [f"model-{i:05d}-of-00008.safetensors" for i in range(1, 9)]
+        filenames += [
+            "config.json",
+            "tokenizer.json",
+            "vocab.json",
+            "merges.txt",
+            "generation_config.json",
+            "tokenizer_config.json",
+            "model.safetensors.index.json",
+        ]
+        comfy_utils.download_hf_snapshot("Qwen/Qwen3-14B",
+                                         "Qwen3-14B",
+                                         self._cache_dir,
+                                         save_dir,
+                                         allow_patterns=filenames,
+                                         force_download=force_download)
\ No newline at end of file
@@ -4,9 +4,12 @@ Base class for building ComfyUI apps to run in the browser
 
 
 import json
+import os
 
 import modal
 
+import comfy_utils
+
 
 class ComfyAppBuilder:
     """
@@ -17,15 +20,10 @@ class ComfyAppBuilder:
     app_builder = ComfyAppBuilder()
     app = app_builder.build_app()
     app_builder.print_output_volume_usage()
-    @app.function(
-        max_containers=1,  # limit interactive session to 1 container
-        gpu=app_builder.gpu,
-        volumes=app_builder.get_volumes(),
-    )
-    @modal.concurrent(max_inputs=10)  # required for UI startup process which runs several API calls concurrently
-    @modal.web_server(8000, startup_timeout=60)
+    @app_builder.register_ui(app)
     def ui():
         subprocess.Popen("comfy launch -- --listen 0.0.0.0 --port 8000", shell=True)
+        app_builder.prefetch_models()
     ```
     """
     def __init__(self):
@@ -36,11 +34,16 @@ class ComfyAppBuilder:
 
         self._app_name = "comfyui"
         self._output_vol_name = "comfyui-output"  # name of output volume
+        self._startup_timeout = 60  # seconds to wait for ComfyUI to start accepting requests
+        # Models (paths relative to the models directory) to read into the page cache when the UI starts; none by default
+        self._prefetch_model_files = []
 
         self._comfy_dir = "/root/comfy/ComfyUI"
         self._comfy_models_dir = f"{self._comfy_dir}/models"
         self._comfy_output_dir = f"{self._comfy_dir}/output"
         self._cache_dir = "/cache"  # mount volume here and download models into this volume
+        # Registry image with ComfyUI already installed by comfy-cli to build on instead of installing ComfyUI in every build
+        self._base_image = os.environ.get("COMFY_BASE_IMAGE")
 
         self._image = None
         self._volumes = {}
@@ -78,6 +81,41 @@ class ComfyAppBuilder:
             self._build_image_and_volumes(redownload_models=redownload_models)
         return self._volumes
 
+    def register_ui(self, app):
+        """
+        Registers the decorated function as the web server function that runs ComfyUI in the browser
+
+        The decorated function must launch ComfyUI on port 8000. Subclasses tune the startup timeout for how long their apps
+        take to start.
+
+        Args:
+            app (modal.App): The app built by `build_app`
+
+        Returns:
+            decorator (callable): Decorator that registers the function with the app
+        """
+        def decorator(f):
+            f = modal.web_server(8000, startup_timeout=self._startup_timeout)(f)
+            # Required for UI startup process which runs several API calls concurrently
+            f = modal.concurrent(max_inputs=10)(f)
+            return app.function(
+                max_containers=1,  # limit interactive session to 1 container
+                gpu=self.gpu,
+                volumes=self.get_volumes(),
+            )(f)
+        return decorator
+
+    def prefetch_models(self):
+        """
+        Starts reading the models the builder lists to prefetch in the background so they load faster when a workflow first uses
+        them
+
+        Call this in the web server function after launching ComfyUI. Does nothing if the builder does not list any models to
+        prefetch.
+        """
+        if self._prefetch_model_files:
+            comfy_utils.prefetch_files([os.path.join(self._comfy_models_dir, path) for path in self._prefetch_model_files])
+
     def print_output_volume_usage(self):
         """
         Prints messages instructing the user how to get and delete output generations
@@ -96,12 +134,14 @@ class ComfyAppBuilder:
             redownload_models (bool): Set to True to force all of the models to be re-downloaded; useful to force download new
                 models
         """
+        # Order the steps from least to most likely to change so that edits only rebuild the layers after them. Local files are
+        # copied right before downloading the models because the download step imports comfy_utils.
         image = self._build_image()
         image = self._install_comfy_nodes(image)
         image = self._post_install_dep(image)
+        image, output_vol = self._create_output_vol(image)
         image = self._copy_files(image)
         image, cache_vol = self._download_models(image, redownload_models=redownload_models)
-        image, output_vol = self._create_output_vol(image)
         self._image = image
         self._volumes = {self._cache_dir: cache_vol, self._comfy_output_dir: output_vol}
 
@@ -109,21 +149,46 @@ class ComfyAppBuilder:
         """
         Installs ComfyUI and other required dependencies.
     
-        We use [comfy-cli](https://github.com/Comfy-Org/comfy-cli) to install ComfyUI and its dependencies.
+        We use [comfy-cli](https://github.com/Comfy-Org/comfy-cli) to install ComfyUI and its dependencies. If the
+        `COMFY_BASE_IMAGE` environment variable is set, the image is built on top of that registry image instead, which must
+        already have ComfyUI installed by comfy-cli, e.g. an image you build with comfy-cli yourself and push to a registry.
     
         Returns:
             image (modal.Image): The built image
         """
-        image = modal.Image.debian_slim(python_version="3.11")
-        image = image.apt_install("git")  # install git to clone ComfyUI
-        image = image.apt_install("wget")  # install wget to download model weights from civitai
-        image = image.pip_install("fastapi[standard]==0.115.4")  # install web dependencies
-        image = image.pip_install("comfy-cli")  # install comfy-cli
-        # Install huggingface_hub with hf_transfer support to speed up model downloads
-        image = image.pip_install("huggingface_hub[hf_transfer]")
+        if self._base_image is None:
+            image = modal.Image.debian_slim(python_version="3.11")
+        else:
+            image = modal.Image.from_registry(self._base_image)  # uses the Python that ComfyUI is installed in
+        image = image.apt_install(
+            "git",  # install git to clone ComfyUI
+            "wget",  # install wget to download model weights from civitai
+            "aria2",  # install aria2 to download large files over multiple connections
+        )
+        image = image.pip_install(
+            "fastapi[standard]==0.115.4",  # install web dependencies
+            "comfy-cli",  # install comfy-cli
+            # Install huggingface_hub with hf_transfer and hf_xet support to speed up model downloads
+            "huggingface_hub[hf_transfer,hf_xet]",
+        )
+        if self._base_image is not None:
+            return image  # ComfyUI is already installed in the base image
+        return self._install_comfy(image)
+
+    def _install_comfy(self, image):
+        """
+        Installs ComfyUI
+
+        Called at the end of `_build_image` unless the image is built on a base image that already has ComfyUI installed.
+
+        Args:
+            image (modal.Image): The image to install ComfyUI in
+
+        Returns:
+            image (modal.Image): The image with ComfyUI installed
+        """
         # Use comfy-cli to install ComfyUI and its dependencies
-        image = image.run_commands("comfy --skip-prompt install --fast-deps --nvidia")
-        return image
+        return image.run_commands("comfy --skip-prompt install --fast-deps --nvidia")
 
     def _post_install_dep(self, image):
         """
@@ -179,12 +244,13 @@ class ComfyAppBuilder:
         image = image.add_local_python_source("comfy_utils", copy=True)
         return image.add_local_file("tokens.json", "/root/tokens.json", copy=True)
 
-    def _hf_download(self, tokens={}):
+    def _hf_download(self, tokens={}, redownload_models=False):
         """
         Download models from HuggingFace
 
         Args:
             tokens (dict{string: string}): Tokens for downloading models from HuggingFace and Civitai
+            redownload_models (bool): Set to True to download the models even if they are already in the cache
         """
         pass
 
@@ -193,6 +259,9 @@ class ComfyAppBuilder:
         Download models and create a cache volume
     
         By persisting the cache to a Volume, you avoid re-downloading the models every time you rebuild your image.
+        Modal reruns this step whenever `_hf_download` or anything it depends on changes, even if the set of models is the same.
+        The rerun only re-creates the symbolic links for models that are already in the cache, so only new models are
+        downloaded, unless `redownload_models` is set.
     
         Args:
             image (modal.Image): The image to download models into and create a cache volume for
@@ -206,13 +275,20 @@ class ComfyAppBuilder:
         with open("tokens.json", "r") as f:
             tokens = json.load(f)  # HuggingFace and Civitai tokens for downloading models
         vol = modal.Volume.from_name("hf-hub-cache", create_if_missing=True)
-        image = image.env({"HF_HUB_ENABLE_HF_TRANSFER": "1"})
+        image = image.env({
+            # Keep all of huggingface_hub's caches, e.g. the Xet chunk cache, in the cache volume so they persist across builds
+            "HF_HOME": self._cache_dir,
+            "HF_HUB_ENABLE_HF_TRANSFER": "1",
+            "HF_XET_HIGH_PERFORMANCE": "1",
+            "HF_ENABLE_PARALLEL_DOWNLOADING": "true",
+            "HF_PARALLEL_DOWNLOADING_WORKERS": "8",
+        })
         image = image.run_function(
             self._hf_download,
             # Persist the HF cache to a Modal Volume so future runs don't need to re-download models
             volumes={self._cache_dir: vol},
             force_build=redownload_models,
-            kwargs={"tokens":tokens},
+            kwargs={"tokens":tokens, "redownload_models":redownload_models},
             )
         return image, vol
 
@@ -16,15 +16,10 @@ class FluxComfyAppBuilder(ComfyAppBuilder):
     app_builder = FluxComfyAppBuilder()
     app = app_builder.build_app()
     app_builder.print_output_volume_usage()
-    @app.function(
-        max_containers=1,  # limit interactive session to 1 container
-        gpu=app_builder.gpu,
-        volumes=app_builder.get_volumes(),
-    )
-    @modal.concurrent(max_inputs=10)  # required for UI startup process which runs several API calls concurrently
-    @modal.web_server(8000, startup_timeout=60)
+    @app_builder.register_ui(app)
     def ui():
         subprocess.Popen("comfy launch -- --listen 0.0.0.0 --port 8000", shell=True)
+        app_builder.prefetch_models()
     ```
     """
     def __init__(self):
@@ -43,25 +38,31 @@ class FluxComfyAppBuilder(ComfyAppBuilder):
     ##############################################################################
     #                             PRIVATE METHODS                                #
     ##############################################################################
-    def _hf_download(self, tokens={}):
+    def _hf_download(self, tokens={}, redownload_models=False):
         """
         Download models from HuggingFace
 
         Args:
             tokens (dict{string: string}): Tokens for downloading models from HuggingFace and Civitai
+            redownload_models (bool): Set to True to download the models even if they are already in the cache
         """
-        super()._hf_download(tokens=tokens)
+        super()._hf_download(tokens=tokens, redownload_models=redownload_models)
         repo = "comfyanonymous/flux_text_encoders"
         save_dir = f"{self._comfy_models_dir}/text_encoders"
-        comfy_utils.download_hf_file(repo, "t5xxl_fp8_e4m3fn_scaled.safetensors", self._cache_dir, save_dir)
-        comfy_utils.download_hf_file(repo, "clip_l.safetensors", self._cache_dir, save_dir)
+        comfy_utils.download_hf_files(repo,
+                                      ["t5xxl_fp8_e4m3fn_scaled.safetensors", "clip_l.safetensors"],
+                                      self._cache_dir,
+                                      save_dir,
+                                      force_download=redownload_models)
         comfy_utils.download_hf_file("Comfy-Org/Lumina_Image_2.0_Repackaged",
                                      "split_files/vae/ae.safetensors",
                                      self._cache_dir,
                                      f"{self._comfy_models_dir}/vae",
-                                     "ae.safetensors")
+                                     "ae.safetensors",
+                                     force_download=redownload_models)
         comfy_utils.download_hf_file("black-forest-labs/FLUX.1-schnell",
                                      "flux1-schnell.safetensors",
                                      self._cache_dir,
                                      f"{self._comfy_models_dir}/unet",
-                                     token=tokens["HF_TOKEN"])
\ No newline at end of file
+                                     token=tokens["HF_TOKEN"],
+                                     force_download=redownload_models)
\ No newline at end of file
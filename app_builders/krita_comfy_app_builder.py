@@ -3,7 +3,8 @@ Class for building ComfyUI apps to run models for the Generative AI plugin for K
 """
 
 
-import subprocess
+from functools import partial
+import os
 
 from app_builders.comfy_app_builder import ComfyAppBuilder
 import comfy_utils
@@ -19,15 +20,10 @@ class KritaComfyAppBuilder(ComfyAppBuilder):
     app_builder = KritaComfyAppBuilder()
     app = app_builder.build_app()
     app_builder.print_output_volume_usage()
-    @app.function(
-        max_containers=1,  # limit interactive session to 1 container
-        gpu=app_builder.gpu,
-        volumes=app_builder.get_volumes(),
-    )
-    @modal.concurrent(max_inputs=10)  # required for UI startup process which runs several API calls concurrently
-    @modal.web_server(8000, startup_timeout=60)
+    @app_builder.register_ui(app)
     def ui():
         subprocess.Popen("comfy launch -- --listen 0.0.0.0 --port 8000", shell=True)
+        app_builder.prefetch_models()
     ```
     """
     def __init__(self):
@@ -56,8 +52,7 @@ class KritaComfyAppBuilder(ComfyAppBuilder):
             image (modal.Image): The built image
         """
         image = super()._build_image()
-        image = image.apt_install("libgl1")  # for controlnet nodes 
-        image = image.apt_install("libglib2.0-0")  # for controlnet nodes 
+        image = image.apt_install("libgl1", "libglib2.0-0")  # for controlnet nodes
         return image
 
     def _install_comfy_nodes(self, image):
@@ -85,131 +80,168 @@ class KritaComfyAppBuilder(ComfyAppBuilder):
             image (modal.Image): The image with the comfy nodes installed
         """
         image = super()._install_comfy_nodes(image)
+        # Install the nodes in one comfy-cli call so their dependencies are resolved and installed together
         image = image.run_commands(
-            "comfy node install --fast-deps comfyui_controlnet_aux",
-            "comfy node install --fast-deps comfyui_ipadapter_plus",
-            "comfy node install --fast-deps comfyui-inpaint-nodes",
-            "comfy node install --fast-deps comfyui-tooling-nodes",
+            "comfy node install --fast-deps comfyui_controlnet_aux comfyui_ipadapter_plus comfyui-inpaint-nodes "
+            "comfyui-tooling-nodes",
         )
         return image
 
-    def _hf_download(self, tokens={}):
+    def _hf_download(self, tokens={}, redownload_models=False):
         """
         Download models from HuggingFace
 
         Args:
             tokens (dict{string: string}): Tokens for downloading models from HuggingFace and Civitai
+            redownload_models (bool): Set to True to download the models even if they are already in the cache
         """
-        super()._hf_download(tokens=tokens)
-        self._illustrious_download()
-        self._clip_vision_download()
-        self._upscale_download()
-        self._inpaint_download(tokens)
-        self._controlnet_download()
-        self._ipadapter_download()
+        super()._hf_download(tokens=tokens, redownload_models=redownload_models)
+        comfy_utils.run_concurrently([
+            partial(self._illustrious_download, redownload_models),
+            partial(self._clip_vision_download, redownload_models),
+            partial(self._upscale_download, redownload_models),
+            partial(self._inpaint_download, tokens, redownload_models),
+            partial(self._controlnet_download, redownload_models),
+            partial(self._ipadapter_download, redownload_models),
+        ])
 
-    def _illustrious_download(self):
+    def _illustrious_download(self, force_download):
         """
         Download Illustrious XL v2.0
+
+        Args:
+            force_download (bool): Set to True to download the models even if they are already in the cache
         """
         comfy_utils.download_hf_file("OnomaAIResearch/Illustrious-XL-v2.0",
                                      "Illustrious-XL-v2.0.safetensors",
                                      self._cache_dir,
-                                     f"{self._comfy_models_dir}/checkpoints")
+                                     f"{self._comfy_models_dir}/checkpoints",
+                                     force_download=force_download)
 
-    def _clip_vision_download(self):
+    def _clip_vision_download(self, force_download):
         """
         Download CLIP ViT-H
+
+        Args:
+            force_download (bool): Set to True to download the models even if they are already in the cache
         """
         comfy_utils.download_hf_file("h94/IP-Adapter",
                                      "models/image_encoder/model.safetensors",
                                      self._cache_dir,
                                      f"{self._comfy_models_dir}/clip_vision",
-                                     "clip-vision_vit-h.safetensors")
+                                     "clip-vision_vit-h.safetensors",
+                                     force_download=force_download)
 
-    def _upscale_download(self):
+    def _upscale_download(self, force_download):
         """
         Download upscaling models
+
+        Args:
+            force_download (bool): Set to True to download the models even if they are already in the cache
         """
         upscale_models_dir = f"{self._comfy_models_dir}/upscale_models"
     
         url = "https://objectstorage.us-phoenix-1.oraclecloud.com/n/ax6ygfvpvzka/b/open-modeldb-files/o/4x-NMKD-YandereNeo.pth"
-        comfy_utils.download_wget_file(url, "4x-NMKD-YandereNeo.pth", self._cache_dir, upscale_models_dir)
-        repo = "Acly/Omni-SR"
-        comfy_utils.download_hf_file(repo, "OmniSR_X2_DIV2K.safetensors", self._cache_dir, upscale_models_dir)
-        comfy_utils.download_hf_file(repo, "OmniSR_X3_DIV2K.safetensors", self._cache_dir, upscale_models_dir)
-        comfy_utils.download_hf_file(repo, "OmniSR_X4_DIV2K.safetensors", self._cache_dir, upscale_models_dir)
-        repo = "Acly/hat"
-        comfy_utils.download_hf_file(repo, "HAT_SRx4_ImageNet-pretrain.pth", self._cache_dir, upscale_models_dir)
-        comfy_utils.download_hf_file(repo, "Real_HAT_GAN_sharper.pth", self._cache_dir, upscale_models_dir)
-
-    def _inpaint_download(self, tokens):
+        tasks = [partial(comfy_utils.download_wget_file,
+                         url,
+                         "4x-NMKD-YandereNeo.pth",
+                         self._cache_dir,
+                         upscale_models_dir,
+                         force_download=force_download)]
+        files = [
+            ("Acly/Omni-SR", "OmniSR_X2_DIV2K.safetensors"),
+            ("Acly/Omni-SR", "OmniSR_X3_DIV2K.safetensors"),
+            ("Acly/Omni-SR", "OmniSR_X4_DIV2K.safetensors"),
+            ("Acly/hat", "HAT_SRx4_ImageNet-pretrain.pth"),
+            ("Acly/hat", "Real_HAT_GAN_sharper.pth"),
+        ]
+        for repo, filename in files:
+            tasks.append(partial(comfy_utils.download_hf_file,
+                                 repo,
+                                 filename,
+                                 self._cache_dir,
+                                 upscale_models_dir,
+                                 force_download=force_download))
+        comfy_utils.run_concurrently(tasks)
+
+    def _inpaint_download(self, tokens, force_download):
         """
         Download AnimagineXL v3.1 Inpainting
 
         Args:
             tokens (dict{string: string}): Tokens for downloading models from HuggingFace and Civitai
+            force_download (bool): Set to True to download the models even if they are already in the cache
         """
         save_dir = f"{self._comfy_models_dir}/inpaint"
-        subprocess.run(
-            f"mkdir -p {save_dir}",
-            shell=True,
-            check=True,
-        )
-        url = f"https://civitai.com/api/download/models/480117?type=Model&format=SafeTensor&size=pruned&fp=fp16&token={tokens["CIVITAI_TOKEN"]}"
-        comfy_utils.download_wget_file(url, "animaginexl_v31Inpainting.safetensors", self._cache_dir, f"{save_dir}")
+        os.makedirs(save_dir, exist_ok=True)
+        civitai_token = tokens["CIVITAI_TOKEN"]
+        url = f"https://civitai.com/api/download/models/480117?type=Model&format=SafeTensor&size=pruned&fp=fp16&token={civitai_token}"
+        comfy_utils.download_wget_file(url,
+                                       "animaginexl_v31Inpainting.safetensors",
+                                       self._cache_dir,
+                                       save_dir,
+                                       force_download=force_download)
 
-    def _controlnet_download(self):
+    def _controlnet_download(self, force_download):
         """
         Download ControlNets
+
+        Args:
+            force_download (bool): Set to True to download the models even if they are already in the cache
         """
         controlnet_dir = f"{self._comfy_models_dir}/controlnet"
     
-        repo = "Eugeoter/noob-sdxl-controlnet-scribble_pidinet"
-        filename = "diffusion_pytorch_model.fp16.safetensors"
-        save_filename = "noob-sdxl-controlnet-scribble_pidinet.fp16.safetensors"
-        comfy_utils.download_hf_file(repo, filename, self._cache_dir, controlnet_dir, save_filename)
-        repo = "Eugeoter/noob-sdxl-controlnet-lineart_anime"
-        filename = "diffusion_pytorch_model.fp16.safetensors"
-        save_filename = "noob-sdxl-controlnet-lineart_anime.fp16.safetensors"
-        comfy_utils.download_hf_file(repo, filename, self._cache_dir, controlnet_dir, save_filename)
-        repo = "Eugeoter/noob-sdxl-controlnet-softedge_hed"
-        filename = "diffusion_pytorch_model.fp16.safetensors"
-        save_filename = "noob-sdxl-controlnet-softedge_hed.fp16.safetensors"
-        comfy_utils.download_hf_file(repo, filename, self._cache_dir, controlnet_dir, save_filename)
-        repo = "Eugeoter/noob-sdxl-controlnet-canny"
-        filename = "noob_sdxl_controlnet_canny.fp16.safetensors"
-        comfy_utils.download_hf_file(repo, filename, self._cache_dir, controlnet_dir)
-        repo = "Eugeoter/noob-sdxl-controlnet-depth_midas-v1-1"
-        filename = "diffusion_pytorch_model.fp16.safetensors"
-        save_filename = "noob-sdxl-controlnet-depth_midas-v1-1.fp16.safetensors"
-        comfy_utils.download_hf_file(repo, filename, self._cache_dir, controlnet_dir, save_filename)
-        repo = "Eugeoter/noob-sdxl-controlnet-normal"
-        filename = "diffusion_pytorch_model.fp16.safetensors"
-        save_filename = "noob-sdxl-controlnet-normal.fp16.safetensors"
-        comfy_utils.download_hf_file(repo, filename, self._cache_dir, controlnet_dir, save_filename)
-        repo = "windsingai/Illustrious-XL-openpose-test"
-        filename = "openpose_s6000.safetensors"
-        comfy_utils.download_hf_file(repo, filename, self._cache_dir, controlnet_dir)
-        repo = "Eugeoter/noob-sdxl-controlnet-tile"
-        filename = "diffusion_pytorch_model.fp16.safetensors"
-        save_filename = "noob-sdxl-controlnet-tile.fp16.safetensors"
-        comfy_utils.download_hf_file(repo, filename, self._cache_dir, controlnet_dir, save_filename)
-
-
-    def _ipadapter_download(self):
+        # (repo, filename, save_filename)
+        files = [
+            ("Eugeoter/noob-sdxl-controlnet-scribble_pidinet",
+             "diffusion_pytorch_model.fp16.safetensors",
+             "noob-sdxl-controlnet-scribble_pidinet.fp16.safetensors"),
+            ("Eugeoter/noob-sdxl-controlnet-lineart_anime",
+             "diffusion_pytorch_model.fp16.safetensors",
+             "noob-sdxl-controlnet-lineart_anime.fp16.safetensors"),
+            ("Eugeoter/noob-sdxl-controlnet-softedge_hed",
+             "diffusion_pytorch_model.fp16.safetensors",
+             "noob-sdxl-controlnet-softedge_hed.fp16.safetensors"),
+            ("Eugeoter/noob-sdxl-controlnet-canny", "noob_sdxl_controlnet_canny.fp16.safetensors", None),
+            ("Eugeoter/noob-sdxl-controlnet-depth_midas-v1-1",
+             "diffusion_pytorch_model.fp16.safetensors",
+             "noob-sdxl-controlnet-depth_midas-v1-1.fp16.safetensors"),
+            ("Eugeoter/noob-sdxl-controlnet-normal",
+             "diffusion_pytorch_model.fp16.safetensors",
+             "noob-sdxl-controlnet-normal.fp16.safetensors"),
+            ("windsingai/Illustrious-XL-openpose-test", "openpose_s6000.safetensors", None),
+            ("Eugeoter/noob-sdxl-controlnet-tile",
+             "diffusion_pytorch_model.fp16.safetensors",
+             "noob-sdxl-controlnet-tile.fp16.safetensors"),
+        ]
+        comfy_utils.run_concurrently([
+            partial(comfy_utils.download_hf_file,
+                    repo,
+                    filename,
+                    self._cache_dir,
+                    controlnet_dir,
+                    save_filename,
+                    force_download=force_download)
+            for repo, filename, save_filename in files
+        ])
+
+    def _ipadapter_download(self, force_download):
         """
         Download IP-Adapters
+
+        Args:
+            force_download (bool): Set to True to download the models even if they are already in the cache
         """
         save_dir = f"{self._comfy_models_dir}/ipadapter"
-        subprocess.run(
-            f"mkdir -p {save_dir}",
-            shell=True,
-            check=True,
-        )
+        os.makedirs(save_dir, exist_ok=True)
         comfy_utils.download_hf_file("h94/IP-Adapter",
                                      "sdxl_models/image_encoder/model.safetensors",
                                      self._cache_dir,
                                      f"{self._comfy_models_dir}/clip_vision",
-                                     "clip-vision_vit-g.safetensors")
-        comfy_utils.download_hf_file("kataragi/Noob_ipadapter", "ip_adapter_Noobtest_800000.bin", self._cache_dir, f"{save_dir}")
\ No newline at end of file
+                                     "clip-vision_vit-g.safetensors",
+                                     force_download=force_download)
+        comfy_utils.download_hf_file("kataragi/Noob_ipadapter",
+                                     "ip_adapter_Noobtest_800000.bin",
+                                     self._cache_dir,
+                                     save_dir,
+                                     force_download=force_download)
\ No newline at end of file
@@ -3,12 +3,27 @@ Class for building ComfyUI apps to run Qwen2.5-VL in the browser
 """
 
 
-import subprocess
+import os
 
 from app_builders.comfy_app_builder import ComfyAppBuilder
 import comfy_utils
 
 
+SHARD_FMT = "model-{idx:05d}-of-{total:05d}.safetensors"
+TOTAL_SHARDS = 18
+CONFIG_FILES = (  # non-weight files Qwen2.5-VL needs next to the shards
+    "config.json",
+    "tokenizer.json",
+    "vocab.json",
+    "merges.txt",
+    "chat_template.json",
+    "preprocessor_config.json",
+    "generation_config.json",
+    "tokenizer_config.json",
+    "model.safetensors.index.json",
+)
+
+
 class QwenComfyAppBuilder(ComfyAppBuilder):
     """
     Class for building ComfyUI apps to run Qwen in the browser
@@ -18,25 +33,36 @@ class QwenComfyAppBuilder(ComfyAppBuilder):
     app_builder = QwenComfyAppBuilder()
     app = app_builder.build_app()
     app_builder.print_output_volume_usage()
-    @app.function(
-        max_containers=1,  # limit interactive session to 1 container
-        gpu=app_builder.gpu,
-        volumes=app_builder.get_volumes(),
-    )
-    @modal.concurrent(max_inputs=10)  # required for UI startup process which runs several API calls concurrently
-    @modal.web_server(8000, startup_timeout=60)
+    @app_builder.register_ui(app)
     def ui():
         subprocess.Popen("comfy launch -- --listen 0.0.0.0 --port 8000", shell=True)
+        app_builder.prefetch_models()
     ```
     """
-    def __init__(self):
+    def __init__(self, required_shards=None):
         """
         Initializes an instance of ACEStepComfyAppBuilder
+
+        Args:
+            required_shards (list[int], optional): The numbers (1 to 18) of the model shards to download. Use the model's
+                `model.safetensors.index.json` to find the shards containing the needed weights. Defaults to the comma separated
+                numbers in the `QWEN_REQUIRED_SHARDS` environment variable, or all shards, which are needed to load the full
+                model, if it is not set.
         """
         super().__init__()
         self.gpu = "A100-80GB"
         self._app_name = "qwen-comfyui"
         self._output_vol_name = "qwen-comfyui-output"  # name of output volume
+        if required_shards is None and os.environ.get("QWEN_REQUIRED_SHARDS"):
+            required_shards = [int(shard) for shard in os.environ["QWEN_REQUIRED_SHARDS"].split(",")]
+        if required_shards is None:
+            required_shards = range(1, TOTAL_SHARDS + 1)
+        invalid_shards = [shard for shard in required_shards if not 1 <= shard <= TOTAL_SHARDS]
+        if invalid_shards:
+            raise ValueError(f"Shards {invalid_shards} are not between 1 and {TOTAL_SHARDS}")
+        self._required_shards = sorted(set(required_shards))
+        # S3 prefix with a copy of the model files to download instead of downloading them from HuggingFace
+        self._s3_weights_uri = os.environ.get("S3_WEIGHTS_URI")
 
     ##############################################################################
     #                             PUBLIC METHODS                                 #
@@ -45,6 +71,24 @@ class QwenComfyAppBuilder(ComfyAppBuilder):
     ##############################################################################
     #                             PRIVATE METHODS                                #
     ##############################################################################
+    def _build_image(self):
+        """
+        Installs ComfyUI and other required dependencies.
+    
+        We use [comfy-cli](https://github.com/Comfy-Org/comfy-cli) to install ComfyUI and its dependencies.
+    
+        Returns:
+            image (modal.Image): The built image
+        """
+        image = super()._build_image()
+        if self._s3_weights_uri is not None:
+            # Install s5cmd to download the model weights from S3
+            image = image.run_commands(
+                "wget -qO- https://github.com/peak/s5cmd/releases/download/v2.3.0/s5cmd_2.3.0_Linux-64bit.tar.gz "
+                "| tar -xz -C /usr/local/bin s5cmd"
+            )
+        return image
+
     def _install_comfy_nodes(self, image):
         """
         Downloads comfy nodes
@@ -70,38 +114,38 @@ class QwenComfyAppBuilder(ComfyAppBuilder):
             image (modal.Image): The image with the comfy nodes installed
         """
         image = super()._install_comfy_nodes(image)
-        image = image.run_commands(
-                "comfy node install --fast-deps ComfyUI-Qwen-VL",
-                "comfy node install --fast-deps comfyui-custom-scripts",
-        )
+        # Install each node in its own layer so changing one node doesn't reinstall the other
+        image = image.run_commands("comfy node install --fast-deps ComfyUI-Qwen-VL")
+        image = image.run_commands("comfy node install --fast-deps comfyui-custom-scripts")
         return image
 
-    def _hf_download(self, tokens={}):
+    def _hf_download(self, tokens={}, redownload_models=False):
         """
         Download models from HuggingFace
 
         Args:
             tokens (dict{string: string}): Tokens for downloading models from HuggingFace and Civitai
+            redownload_models (bool): Set to True to download the models even if they are already in the cache
         """
-        super()._hf_download(tokens=tokens)
+        super()._hf_download(tokens=tokens, redownload_models=redownload_models)
 
         save_dir = f"{self._comfy_models_dir}/Qwen/Qwen-VL/Qwen2.5-VL-32B-Instruct"
     
-        subprocess.run(
-            f"mkdir -p {save_dir}",
-            shell=True,
-            check=True,
-        )
+        os.makedirs(save_dir, exist_ok=True)
     
+        if self._s3_weights_uri is not None:
+            credentials = {key: value for key, value in tokens.items() if key.startswith("AWS_")}
+            comfy_utils.download_s3_prefix(self._s3_weights_uri,
+                                           self._cache_dir,
+                                           save_dir,
+                                           credentials=credentials,
+                                           force_download=redownload_models)
+            return
+
         repo = "Qwen/Qwen2.5-VL-32B-Instruct"
-        for i in range(18):
-            comfy_utils.download_hf_file(repo, "model-000"+str(i+1).zfill(2)+"-of-00018.safetensors", self._cache_dir, save_dir)
-        comfy_utils.download_hf_file(repo, "config.json", self._cache_dir, save_dir)
-        comfy_utils.download_hf_file(repo, "tokenizer.json", self._cache_dir, save_dir)
-        comfy_utils.download_hf_file(repo, "vocab.json", self._cache_dir, save_dir)
-        comfy_utils.download_hf_file(repo, "merges.txt", self._cache_dir, save_dir)
-        comfy_utils.download_hf_file(repo, "chat_template.json", self._cache_dir, save_dir)
-        comfy_utils.download_hf_file(repo, "preprocessor_config.json", self._cache_dir, save_dir)
-        comfy_utils.download_hf_file(repo, "generation_config.json", self._cache_dir, save_dir)
-        comfy_utils.download_hf_file(repo, "tokenizer_config.json", self._cache_dir, save_dir)
-        comfy_utils.download_hf_file(repo, "model.safetensors.index.json", self._cache_dir, save_dir)
\ No newline at end of file
+        shard_files = [SHARD_FMT.format(idx=i, total=TOTAL_SHARDS) for i in self._required_shards]
+        comfy_utils.download_hf_files(repo,
+                                      shard_files + list(CONFIG_FILES),
+                                      self._cache_dir,
+                                      save_dir,
+                                      force_download=redownload_models)
\ No newline at end of file
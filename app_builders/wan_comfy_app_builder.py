@@ -3,6 +3,8 @@ Class for building ComfyUI apps to run a checkpoint of Wan2.1 Image-to-Video for
 """
 
 
+from functools import partial
+
 from app_builders.comfy_app_builder import ComfyAppBuilder
 import comfy_utils
 
@@ -16,15 +18,10 @@ class WanComfyAppBuilder(ComfyAppBuilder):
     app_builder = WanComfyAppBuilder()
     app = app_builder.build_app()
     app_builder.print_output_volume_usage()
-    @app.function(
-        max_containers=1,  # limit interactive session to 1 container
-        gpu=app_builder.gpu,
-        volumes=app_builder.get_volumes(),
-    )
-    @modal.concurrent(max_inputs=10)  # required for UI startup process which runs several API calls concurrently
-    @modal.web_server(8000, startup_timeout=60)
+    @app_builder.register_ui(app)
     def ui():
         subprocess.Popen("comfy launch -- --listen 0.0.0.0 --port 8000", shell=True)
+        app_builder.prefetch_models()
     ```
     """
     def __init__(self):
@@ -68,34 +65,52 @@ class WanComfyAppBuilder(ComfyAppBuilder):
             image (modal.Image): The image with the comfy nodes installed
         """
         image = super()._install_comfy_nodes(image)
-        image = image.run_commands(
-            "comfy node install --fast-deps ComfyUI-GGUF",
-            "comfy node install --fast-deps ComfyUI-WanStartEndFramesNative",
-        )
+        # Install each node in its own layer so changing one node doesn't reinstall the other
+        image = image.run_commands("comfy node install --fast-deps ComfyUI-GGUF")
+        image = image.run_commands("comfy node install --fast-deps ComfyUI-WanStartEndFramesNative")
         return image
 
-    def _hf_download(self, tokens={}):
+    def _hf_download(self, tokens={}, redownload_models=False):
         """
         Download models from HuggingFace
 
         Args:
             tokens (dict{string: string}): Tokens for downloading models from HuggingFace and Civitai
+            redownload_models (bool): Set to True to download the models even if they are already in the cache
         """
-        super()._hf_download(tokens=tokens)
+        super()._hf_download(tokens=tokens, redownload_models=redownload_models)
+
+        text_encoders_dir = f"{self._comfy_models_dir}/text_encoders"
+        vae_dir = f"{self._comfy_models_dir}/vae"
+        clip_vision_dir = f"{self._comfy_models_dir}/clip_vision"
+        diffusion_models_dir = f"{self._comfy_models_dir}/diffusion_models"
 
         repo = "Comfy-Org/Wan_2.1_ComfyUI_repackaged"
-    
-        filename = "split_files/text_encoders/umt5_xxl_fp8_e4m3fn_scaled.safetensors"
-        save_filename = "umt5_xxl_fp8_e4m3fn_scaled.safetensors"
-        comfy_utils.download_hf_file(repo, filename, self._cache_dir, f"{self._comfy_models_dir}/text_encoders", save_filename)
-        filename = "split_files/vae/wan_2.1_vae.safetensors"
-        save_filename = "wan_2.1_vae.safetensors"
-        comfy_utils.download_hf_file(repo, filename, self._cache_dir, f"{self._comfy_models_dir}/vae", save_filename)
-        filename = "split_files/clip_vision/clip_vision_h.safetensors"
-        save_filename = "clip_vision_h.safetensors"
-        comfy_utils.download_hf_file(repo, filename, self._cache_dir, f"{self._comfy_models_dir}/clip_vision", save_filename)
-        url = f"https://civitai.com/api/download/models/1873761?type=Model&format=GGUF&size=full&fp=fp32&token={tokens["CIVITAI_TOKEN"]}"
-        comfy_utils.download_wget_file(url,
-                                       "liveWallpaperFast_i2v14B720P.gguf",
-                                       self._cache_dir,
-                                       f"{self._comfy_models_dir}/diffusion_models")
\ No newline at end of file
+        # (filename, save_dir, save_filename)
+        files = [
+            ("split_files/text_encoders/umt5_xxl_fp8_e4m3fn_scaled.safetensors",
+             text_encoders_dir,
+             "umt5_xxl_fp8_e4m3fn_scaled.safetensors"),
+            ("split_files/vae/wan_2.1_vae.safetensors", vae_dir, "wan_2.1_vae.safetensors"),
+            ("split_files/clip_vision/clip_vision_h.safetensors", clip_vision_dir, "clip_vision_h.safetensors"),
+        ]
+        tasks = [
+            partial(comfy_utils.download_hf_file,
+                    repo,
+                    filename,
+                    self._cache_dir,
+                    save_dir,
+                    save_filename,
+                    force_download=redownload_models)
+            for filename, save_dir, save_filename in files
+        ]
+        civitai_token = tokens["CIVITAI_TOKEN"]
+        url = f"https://civitai.com/api/download/models/1873761?type=Model&format=GGUF&size=full&fp=fp32&token={civitai_token}"
+        # The GGUF takes the longest to download, so download the HuggingFace files while it downloads
+        tasks.append(partial(comfy_utils.download_wget_file,
+                             url,
+                             "liveWallpaperFast_i2v14B720P.gguf",
+                             self._cache_dir,
+                             diffusion_models_dir,
+                             force_download=redownload_models))
+        comfy_utils.run_concurrently(tasks)
\ No newline at end of file
@@ -1,7 +1,11 @@
+from concurrent.futures import ThreadPoolExecutor
+import os
+import shutil
 import subprocess
+import threading
 
 
-def download_hf_file(repo, filename, cache_dir, save_dir, save_filename=None, token=None):
+def download_hf_file(repo, filename, cache_dir, save_dir, save_filename=None, token=None, force_download=False):
     """
     Downloads a file from HuggingFace and creates a symbolic link to it in the specified directory
 
@@ -12,25 +16,69 @@ def download_hf_file(repo, filename, cache_dir, save_dir, save_filename=None, to
         save_dir (string): The directory to create the symbolic link in that points to the file downloaded into the cache directory
         save_filename (string, optional): The name of the symbolic link. Defaults to `filename`.
         token (string, optional): HuggingFace token to use for downloading the file
+        force_download (bool, optional): Set to True to download the file even if it is already in the cache. Defaults to False.
     """
     from huggingface_hub import hf_hub_download
+    from huggingface_hub.errors import LocalEntryNotFoundError
 
-    print(f"Downloading {repo}/{filename}")
-    path = hf_hub_download(
-        repo_id=repo,
-        filename=filename,
-        cache_dir=cache_dir,
-        token=token,
-    )
     save_filename = filename if save_filename is None else save_filename
-    subprocess.run(
-        f"ln -s {path} {save_dir}/{save_filename}",
-        shell=True,
-        check=True,
-    )
+    path = None
+    if not force_download:
+        try:
+            # Skip the request to HuggingFace if the file is already in the cache
+            path = hf_hub_download(
+                repo_id=repo,
+                filename=filename,
+                cache_dir=cache_dir,
+                local_files_only=True,
+            )
+            print(f"Using cached {repo}/{filename}")
+        except LocalEntryNotFoundError:
+            pass
+    if path is None:
+        print(f"Downloading {repo}/{filename}")
+        path = hf_hub_download(
+            repo_id=repo,
+            filename=filename,
+            cache_dir=cache_dir,
+            token=token,
+            etag_timeout=2,
+            force_download=force_download,
+        )
+    # Link to the file in the cache rather than downloading it with `local_dir`, which stores a copy of the file in the image
+    # instead of the cache volume
+    _link(path, save_dir, save_filename)
+
+
+def download_hf_files(repo, filenames, cache_dir, save_dir, token=None, force_download=False):
+    """
+    Downloads files from a HuggingFace repository in a single snapshot and creates symbolic links to them in the specified
+    directory
 
+    Downloading the files together reuses one request for the repository's metadata and lets `snapshot_download` download the
+    files concurrently.
 
-def download_hf_snapshot(repo, dir_name, cache_dir, save_dir, allow_patterns=[], ignore_patterns=[]):
+    Args:
+        repo (string): The HuggingFace repository
+        filenames (list[string]): The paths to the files to download in the HuggingFace repository
+        cache_dir (stirng): The directory to download the files into
+        save_dir (string): The directory to create the symbolic links in that point to the files downloaded into the cache
+            directory
+        token (string, optional): HuggingFace token to use for downloading the files
+        force_download (bool, optional): Set to True to download the files even if they are already in the cache. Defaults to
+            False.
+    """
+    print(f"Downloading {', '.join(f'{repo}/{filename}' for filename in filenames)}")
+    path = _snapshot_download(repo, cache_dir, allow_patterns=filenames, token=token, force_download=force_download)
+    # `snapshot_download` silently skips allowed files that are not in the repository, which would leave dangling links
+    missing = [filename for filename in filenames if not os.path.exists(os.path.join(path, filename))]
+    if missing:
+        raise FileNotFoundError(f"{', '.join(missing)} not found in HuggingFace repository {repo}")
+    for filename in filenames:
+        _link(os.path.join(path, filename), save_dir, filename)
+
+
+def download_hf_snapshot(repo, dir_name, cache_dir, save_dir, allow_patterns=[], ignore_patterns=[], force_download=False):
     """
     Downloads a snapshot of a HuggingFace repository and creates a symbolic link to it in the specified directory
 
@@ -44,42 +92,250 @@ def download_hf_snapshot(repo, dir_name, cache_dir, save_dir, allow_patterns=[],
             all files being downloaded.
         ignore_patterns (list[string]): All files in the repository matching the ignore patterns will not be downlaoded. Defaults
             to no files being ignored.
+        force_download (bool, optional): Set to True to download the snapshot even if it is already in the cache. Defaults to
+            False.
     """
-    from huggingface_hub import snapshot_download
-
     print(f"Downloading {repo}")
-    path = snapshot_download(
-        repo_id=repo,
-        allow_patterns=allow_patterns,
-        ignore_patterns=ignore_patterns,
-        cache_dir=cache_dir,
-    )
-    subprocess.run(
-        f"ln -s {path} {save_dir}/{dir_name}",
-        shell=True,
-        check=True,
-    )
+    path = _snapshot_download(repo,
+                              cache_dir,
+                              allow_patterns=allow_patterns,
+                              ignore_patterns=ignore_patterns,
+                              force_download=force_download)
+    _link(path, save_dir, dir_name)
 
 
-def download_wget_file(url, filename, cache_dir, save_dir):
+def download_wget_file(url, filename, cache_dir, save_dir, force_download=False):
     """
     Downloads a file and creates a symbolic link to it in the specified directory
 
+    Uses aria2 to download the file over multiple connections if it is installed, otherwise wget.
+
     Args:
         url (string): The URL of the file to download
         filename (string): The name you choose for the file
         cache_dir (stirng): The directory to download the file into
         save_dir (string): The directory to create the symbolic link in that points to the file downloaded into the cache directory
+        force_download (bool, optional): Set to True to download the file even if it is already in the cache. Defaults to False.
     """
-    print(f"Downloading {url}")
     path = f"{cache_dir}/{filename}"
+    if not force_download and _is_downloaded(path):
+        print(f"Using cached {path}")
+    else:
+        print(f"Downloading {url}")
+        if shutil.which("aria2c") is not None:
+            _aria2(url, path)
+        else:
+            _wget(url, path)
+    _link(path, save_dir, filename)
+
+
+def download_s3_prefix(s3_uri, cache_dir, save_dir, credentials={}, force_download=False):
+    """
+    Downloads all files under an S3 prefix with s5cmd and creates symbolic links to them in the specified directory
+
+    s5cmd downloads the files concurrently. It syncs the files into the cache so files that are already in the cache and have not
+    changed are not downloaded again.
+
+    Args:
+        s3_uri (string): The S3 prefix to download, e.g. s3://<bucket>/<path>
+        cache_dir (stirng): The directory to download the files into
+        save_dir (string): The directory to create the symbolic links in that point to the files downloaded into the cache
+            directory
+        credentials (dict{string: string}): AWS environment variables for accessing the bucket, e.g. `AWS_ACCESS_KEY_ID` and
+            `AWS_SECRET_ACCESS_KEY`. Defaults to the credentials in the environment.
+        force_download (bool, optional): Set to True to download the files even if they are already in the cache. Defaults to
+            False.
+    """
+    print(f"Downloading {s3_uri}")
+    s3_uri = s3_uri.rstrip("/")
+    path = os.path.join(cache_dir, "s3", s3_uri.removeprefix("s3://"))
+    os.makedirs(path, exist_ok=True)
+    command = "cp" if force_download else "sync"  # cp overwrites files that are already in the cache
     subprocess.run(
-        f"wget -q -O {path} {url}",
+        f"s5cmd {command} --concurrency 16 '{s3_uri}/*' {path}/",
         shell=True,
         check=True,
+        env={**os.environ, **credentials},
+    )
+    for filename in os.listdir(path):
+        _link(os.path.join(path, filename), save_dir, filename)
+
+
+def run_concurrently(tasks):
+    """
+    Runs independent download tasks concurrently in a thread pool
+
+    Downloads are network bound, so running them in threads overlaps their transfers. Parallel downloading is enabled by setting
+    the `HF_ENABLE_PARALLEL_DOWNLOADING` environment variable to "true", and the number of threads is set by
+    `HF_PARALLEL_DOWNLOADING_WORKERS`. Otherwise, the tasks are run one after another.
+
+    Args:
+        tasks (list[callable]): Functions that take no arguments to run
+    """
+    if os.environ.get("HF_ENABLE_PARALLEL_DOWNLOADING", "false").lower() != "true":
+        for task in tasks:
+            task()
+        return
+    max_workers = int(os.environ.get("HF_PARALLEL_DOWNLOADING_WORKERS", "8"))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(task) for task in tasks]
+        for future in futures:
+            future.result()  # re-raise any exception from the task
+
+
+def prefetch_files(paths, max_workers=8):
+    """
+    Reads files in a background thread so they are in the page cache when they are first used
+
+    ComfyUI loads models from disk when a workflow first uses them. Reading the models ahead of time in the background moves most
+    of the time spent reading them from the volume out of the first workflow's critical path. Only prefetch models a workflow
+    will load, since every file read competes for I/O with ComfyUI's own loads.
+
+    Args:
+        paths (list[string]): The paths to the files to read. Symbolic links are followed.
+        max_workers (int, optional): The number of files to read at a time. Defaults to 8.
+    """
+    def read(path):
+        buffer = bytearray(16 * 1024 * 1024)
+        try:
+            with open(path, "rb", buffering=0) as f:
+                while f.readinto(buffer):
+                    pass
+        except OSError:
+            pass  # e.g. a broken symbolic link; ComfyUI will report it if a workflow uses the file
+
+    def prefetch():
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            executor.map(read, paths)
+        print(f"Prefetched {len(paths)} files")
+
+    threading.Thread(target=prefetch, daemon=True).start()
+
+
+def _is_downloaded(path):
+    """
+    Checks if a file downloaded from a URL is already complete in the cache
+
+    The cache directory is a persisted volume, so files downloaded by a previous build are still there when the download step is
+    rerun. aria2 keeps a `.aria2` control file next to a file until it is completely downloaded.
+
+    Args:
+        path (string): The path to the file in the cache directory
+
+    Returns:
+        downloaded (bool): True if the file is completely downloaded
+    """
+    return os.path.exists(path) and not os.path.exists(f"{path}.aria2")
+
+
+def _link(path, save_dir, save_filename):
+    """
+    Creates a symbolic link in the specified directory that points to a downloaded file or directory
+
+    Args:
+        path (string): The path to the downloaded file or directory
+        save_dir (string): The directory to create the symbolic link in
+        save_filename (string): The name of the symbolic link
+    """
+    target = os.path.join(save_dir, save_filename)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    if not os.path.islink(target):
+        os.symlink(path, target)
+
+
+def _snapshot_download(repo, cache_dir, allow_patterns=[], ignore_patterns=[], token=None, force_download=False):
+    """
+    Downloads a snapshot of a HuggingFace repository into the cache, using the cached snapshot without any network requests if
+    it has all of the allowed files
+
+    A cached snapshot is only used if `allow_patterns` are all file names rather than glob patterns because only then can it be
+    checked that no files are missing, e.g. from an interrupted download.
+
+    Args:
+        repo (string): The HuggingFace repository
+        cache_dir (stirng): The directory to download the snapshot into
+        allow_patterns (list[string]): All files in the repository matching the allowed patterns will be downlaoded. Defaults to
+            all files being downloaded.
+        ignore_patterns (list[string]): All files in the repository matching the ignore patterns will not be downlaoded. Defaults
+            to no files being ignored.
+        token (string, optional): HuggingFace token to use for downloading the snapshot
+        force_download (bool, optional): Set to True to download the snapshot even if it is already in the cache. Defaults to
+            False.
+
+    Returns:
+        path (string): The path to the snapshot in the cache
+    """
+    from huggingface_hub import snapshot_download
+    from huggingface_hub.errors import LocalEntryNotFoundError
+
+    if not force_download and allow_patterns and not any(c in pattern for pattern in allow_patterns for c in "*?["):
+        try:
+            path = snapshot_download(
+                repo_id=repo,
+                allow_patterns=allow_patterns,
+                ignore_patterns=ignore_patterns,
+                cache_dir=cache_dir,
+                local_files_only=True,
+            )
+            if all(os.path.exists(os.path.join(path, filename)) for filename in allow_patterns):
+                return path
+        except LocalEntryNotFoundError:
+            pass
+    return snapshot_download(
+        repo_id=repo,
+        allow_patterns=allow_patterns,
+        ignore_patterns=ignore_patterns,
+        cache_dir=cache_dir,
+        token=token,
+        etag_timeout=2,
+        force_download=force_download,
     )
+
+
+def _aria2(url, path, connections=16):
+    """
+    Downloads a file over multiple connections with aria2
+
+    aria2 splits the file into byte ranges and downloads them in parallel, which is much faster than a single connection for hosts
+    that cap the bandwidth per connection like Civitai. Falls back to wget if aria2 fails.
+
+    Args:
+        url (string): The URL of the file to download
+        path (string): The path to download the file to
+        connections (int, optional): The number of connections to download the file over. Defaults to 16.
+    """
+    try:
+        subprocess.run(
+            f"aria2c -q -x {connections} -s {connections} -k 1M --allow-overwrite=true --auto-file-renaming=false "
+            # Preallocate the file and buffer writes in memory to write to disk in fewer, larger chunks
+            f"--file-allocation=falloc --disk-cache=64M "
+            f"-d {os.path.dirname(path)} -o {os.path.basename(path)} '{url}'",
+            shell=True,
+            check=True,
+        )
+    except subprocess.CalledProcessError:
+        # Fall back to a single connection download, e.g. if the server rejects the ranged requests aria2 makes
+        print(f"aria2 failed to download {url}; retrying with wget")
+        _wget(url, path)
+        # Remove the control file aria2 left behind so the file is recognized as completely downloaded
+        if os.path.exists(f"{path}.aria2"):
+            os.remove(f"{path}.aria2")
+
+
+def _wget(url, path):
+    """
+    Downloads a file with wget
+
+    The file is downloaded to a temporary path and moved into place once it is complete so an interrupted download is never
+    mistaken for a cached file.
+
+    Args:
+        url (string): The URL of the file to download
+        path (string): The path to download the file to
+    """
     subprocess.run(
-        f"ln -s {path} {save_dir}/{filename}",
+        f"wget -q -O {path}.part '{url}'",
         shell=True,
         check=True,
-    )
\ No newline at end of file
+    )
+    os.replace(f"{path}.part", path)
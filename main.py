@@ -8,43 +8,48 @@ For ace-step, flux, qwen, and wan, open ComfyUI in the browser using the web fun
 For krita, use the web function UI URL as the server URL for the plugin.
 """
 
+import importlib
 import os
 import subprocess
 
 import modal
 
-from app_builders.ace_step_comfy_app_builder import ACEStepComfyAppBuilder
-from app_builders.flux_comfy_app_builder import FluxComfyAppBuilder
-from app_builders.krita_comfy_app_builder import KritaComfyAppBuilder
-from app_builders.qwen_comfy_app_builder import QwenComfyAppBuilder
-from app_builders.wan_comfy_app_builder import WanComfyAppBuilder
-
 
 REDOWNLOAD_MODELS = False  # set to True to force all of the models to be re-downloaded; useful to force download new models
 
+# "<module>:<class>" of each app's builder; only the selected app's module is imported
 APP_REGISTRY = {
-    "ace-step": ACEStepComfyAppBuilder,
-    "flux": FluxComfyAppBuilder,
-    "krita": KritaComfyAppBuilder,
-    "qwen": QwenComfyAppBuilder,
-    "wan": WanComfyAppBuilder,
+    "ace-step": "app_builders.ace_step_comfy_app_builder:ACEStepComfyAppBuilder",
+    "flux": "app_builders.flux_comfy_app_builder:FluxComfyAppBuilder",
+    "krita": "app_builders.krita_comfy_app_builder:KritaComfyAppBuilder",
+    "qwen": "app_builders.qwen_comfy_app_builder:QwenComfyAppBuilder",
+    "wan": "app_builders.wan_comfy_app_builder:WanComfyAppBuilder",
 }
 
 
-try:
-    app_name = os.environ["APP"]
-except:
-    raise ValueError("Environment variable `APP` was not set")
-
-app_builder = APP_REGISTRY[app_name.lower().strip()]()
-app = app_builder.build_app()
-app_builder.print_output_volume_usage()
-@app.function(
-    max_containers=1,  # limit interactive session to 1 container
-    gpu=app_builder.gpu,
-    volumes=app_builder.get_volumes(),
-)
-@modal.concurrent(max_inputs=10)  # required for UI startup process which runs several API calls concurrently
-@modal.web_server(8000, startup_timeout=60)
+def get_app_builder():
+    """
+    Gets the app builder for the app set by the `APP` environment variable
+
+    Returns:
+        app_builder (ComfyAppBuilder): The app builder
+    """
+    try:
+        app_name = os.environ["APP"]
+    except:
+        raise ValueError("Environment variable `APP` was not set")
+    module_path, class_name = APP_REGISTRY[app_name.lower().strip()].split(":")
+    app_builder_class = getattr(importlib.import_module(module_path), class_name)
+    return app_builder_class()
+
+
+app_builder = get_app_builder()
+app = app_builder.build_app(redownload_models=REDOWNLOAD_MODELS)
+if modal.is_local():  # only print the usage for the user running `modal serve`, not in every container
+    app_builder.print_output_volume_usage()
+
+
+@app_builder.register_ui(app)
 def ui():
-    subprocess.Popen("comfy launch -- --listen 0.0.0.0 --port 8000", shell=True)
\ No newline at end of file
+    subprocess.Popen("comfy launch -- --listen 0.0.0.0 --port 8000", shell=True)
+    app_builder.prefetch_models()
\ No newline at end of file